@@ -1,142 +1,298 @@
 import boto3
+import hashlib
 import json
+import logging
 import os
+import time
+from collections import namedtuple
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
+from types import MappingProxyType
 from botocore.exceptions import ClientError
 from botocore.config import Config
 
-retry_config = Config(retries={"max_attempts": 5, "mode": "standard"})
+try:
+    import orjson
+except ImportError:  # optional; only present when bundled with the function
+    orjson = None
+
+logger = logging.getLogger()
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "WARNING").upper()
+# An unknown level name would make setLevel raise at import and break every
+# invocation, so fall back to the default instead.
+logger.setLevel(LOG_LEVEL if LOG_LEVEL in logging.getLevelNamesMapping() else "WARNING")
+
+BUILD_WORKERS = 8
+PARALLEL_BUILD_THRESHOLD = 100
+TAG_FILTER_SHARD_SIZE = 5
+TAG_DISCOVERY_WORKERS = 8
+METRIC_DATA_BATCH_SIZE = 500
+METRIC_DATA_PERIOD = 300
+METRIC_LOOKBACK_SECONDS = 3600
+AGENT_INDEX_SCAN_THRESHOLD = 20
+METRICS_CACHE_FILE = "/tmp/cwagent_cache.json"
+METRICS_CACHE_TTL = int(os.environ.get("METRICS_CACHE_TTL", 900))
+
+retry_config = Config(
+    retries={"max_attempts": 5, "mode": "standard"},
+    max_pool_connections=32,
+    tcp_keepalive=True,
+)
 
-ec2_client = boto3.client("ec2", config=retry_config)
 cloudwatch_client = boto3.client("cloudwatch", config=retry_config)
+tagging_client = boto3.client("resourcegroupstaggingapi", config=retry_config)
+
+
+def load_metrics_cache():
+    try:
+        with open(METRICS_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# list_metrics results keyed by query, as {key: [timestamp, value]}. Lives for
+# the lifetime of the container and is persisted to /tmp so a new handler
+# instance on the same sandbox starts warm.
+metrics_cache = load_metrics_cache()
+
+
+# Digest of the last body written by PutDashboard. Kept in memory only, so a
+# new execution environment always writes the dashboard once, restoring it if
+# it was deleted or edited in the console.
+last_dashboard_digest = None
 
 # Full Master Configuration for all possible tag-based services
 ALL_SERVICES_CONFIG = {
     "ec2_instance": {
         "filter": "ec2:instance",
         "id": "instance/",
-        "builder": "create_ec2_hybrid_widget",
+        "is_dynamic": True,
     },
     "rds_instance": {
         "filter": "rds:db",
         "id": ":db:",
-        "builder": "create_rds_detailed_widget",
     },
     "lambda_function": {
         "filter": "lambda:function",
         "id": ":function:",
-        "builder": "create_lambda_widget",
     },
     "alb": {
         "filter": "elasticloadbalancing:loadbalancer",
         "id": "loadbalancer/app",
-        "builder": "create_alb_widget",
     },
     "nlb": {
         "filter": "elasticloadbalancing:loadbalancer",
         "id": "loadbalancer/net",
-        "builder": "create_nlb_widget",
     },
     "classic_elb": {
         "filter": "elasticloadbalancing:loadbalancer",
         "id": "loadbalancer",
-        "builder": "create_classic_elb_widget",
+        # ALB/NLB/GWLB ARNs also contain "loadbalancer"; never route them here.
+        "exclude_ids": ("loadbalancer/app/", "loadbalancer/net/", "loadbalancer/gwy/"),
     },
     "ecs_service": {
         "filter": "ecs:service",
         "id": "service/",
-        "builder": "create_ecs_widget",
     },
     "eks_cluster": {
         "filter": "eks:cluster",
         "id": "cluster/",
-        "builder": "create_eks_widget",
     },
     "dynamodb_table": {
         "filter": "dynamodb:table",
         "id": "table/",
-        "builder": "create_dynamodb_widget",
     },
     "redshift_cluster": {
         "filter": "redshift:cluster",
         "id": "cluster:",
-        "builder": "create_redshift_widget",
     },
     "sqs_queue": {
         "filter": "sqs",
         "id": "arn:aws:sqs:",
-        "builder": "create_sqs_widget",
     },
     "sns_topic": {
         "filter": "sns",
         "id": "arn:aws:sns:",
-        "builder": "create_sns_widget",
     },
     "cloudfront_distribution": {
         "filter": "cloudfront:distribution",
         "id": "distribution/",
-        "builder": "create_cloudfront_widget",
         "is_global": True,
     },
     "route53_healthcheck": {
         "filter": "route53:healthcheck",
         "id": "healthcheck/",
-        "builder": "create_route53_widget",
         "is_global": True,
     },
     "acm_certificate": {
         "filter": "acm:certificate",
         "id": "certificate/",
-        "builder": "create_acm_widget",
         "is_global": True,
     },
     "elasticache_cluster": {
         "filter": "elasticache:cluster",
         "id": "cluster:",
-        "builder": "create_elasticache_widget",
     },
     "fsx_filesystem": {
         "filter": "fsx:filesystem",
         "id": "filesystem/",
-        "builder": "create_fsx_widget",
     },
     "storage_gateway": {
         "filter": "storagegateway:gateway",
         "id": "gateway/",
-        "builder": "create_storagegateway_widget",
     },
     "dx_connection": {
         "filter": "directconnect:dxcon",
         "id": "dxcon/",
-        "builder": "create_dx_widget",
     },
     "vpn_connection": {
         "filter": "ec2:vpn-connection",
         "id": "vpn-",
-        "builder": "create_vpn_widget",
     },
     "apigateway_stage": {
         "filter": "apigateway:stages",
         "id": "apis/",
-        "builder": "create_apigateway_widget",
     },
     "stepfunctions_statemachine": {
         "filter": "states",
         "id": "stateMachine:",
-        "builder": "create_stepfunctions_widget",
     },
     "mq_broker": {
         "filter": "mq:broker",
         "id": "broker:",
-        "builder": "create_mq_widget",
     },
 }
 
+# Environment configuration never changes for the lifetime of the container,
+# so it is parsed once at cold start rather than on every invocation.
+SLO_TARGET = float(os.environ.get("SLO_TARGET", 99.9))
+CPU_SLO_TARGET = float(os.environ.get("CPU_SLO_TARGET", 80.0))
+RDS_CPU_SLO_TARGET = float(os.environ.get("RDS_CPU_SLO_TARGET", 80.0))
+LATENCY_SLO_TARGET_MS = float(os.environ.get("LATENCY_SLO_TARGET", 10.0))
+LATENCY_SLO_TARGET_S = LATENCY_SLO_TARGET_MS / 1000.0
+
+SERVICE_CONFIG = {
+    key: ALL_SERVICES_CONFIG[key]
+    for key in os.environ.get("ENABLED_WIDGETS", "").split(",")
+    if key in ALL_SERVICES_CONFIG
+}
+RESOURCE_TYPE_FILTERS = sorted({svc["filter"] for svc in SERVICE_CONFIG.values()})
+# Longest id first, so the first substring hit is the most specific match.
+# sorted() is stable, so equal-length ids keep their ENABLED_WIDGETS order.
+DISPATCH_CONFIGS = sorted(
+    SERVICE_CONFIG.values(), key=lambda c: len(c["id"]), reverse=True
+)
+# Ids that are a full "arn:aws:<service>:" prefix pin the service outright, so
+# they are checked with one anchored startswith() before the substring scan.
+PREFIX_CONFIGS = [c for c in DISPATCH_CONFIGS if c["id"].startswith("arn:")]
+PREFIX_IDS = tuple(c["id"] for c in PREFIX_CONFIGS)
+SUBSTRING_CONFIGS = [c for c in DISPATCH_CONFIGS if not c["id"].startswith("arn:")]
+
+# DIMENSION_CONFIG maps a namespace to [{"Name": ..., "Value": ...}, ...]; the
+# entries are converted to Dim tuples once here rather than per widget.
+Dim = namedtuple("Dim", "name value")
+
+
+def parse_dimension_config(config):
+    return {
+        namespace: [Dim(d["Name"], d["Value"]) for d in dims]
+        for namespace, dims in config.items()
+    }
+
+
+try:
+    DIMENSION_CONFIG = parse_dimension_config(
+        json.loads(os.environ.get("DIMENSION_CONFIG", "{}"))
+    )
+except (json.JSONDecodeError, AttributeError, KeyError, TypeError):
+    logger.warning("Could not parse DIMENSION_CONFIG. Using default dimensions.")
+    DIMENSION_CONFIG = {}
+
+custom_widgets_json = os.environ.get("CUSTOM_WIDGETS_CONFIG", "[]")
+try:
+    CUSTOM_WIDGET_DEFS = json.loads(custom_widgets_json)
+except json.JSONDecodeError:
+    logger.warning(
+        "Could not parse CUSTOM_WIDGETS_CONFIG. Invalid JSON: %s", custom_widgets_json
+    )
+    CUSTOM_WIDGET_DEFS = []
+
+# Shared metric options and views, referenced by every builder instead of
+# fresh literals. The same objects appear in many widgets, so the stat options
+# are read-only proxies; dumps_dashboard_body() serializes them via dict().
+STAT_SUM = MappingProxyType({"stat": "Sum"})
+STAT_MIN = MappingProxyType({"stat": "Minimum"})
+STAT_AVG = MappingProxyType({"stat": "Average"})
+STAT_MAX = MappingProxyType({"stat": "Maximum"})
+VIEW_TIME_SERIES = "timeSeries"
+VIEW_SINGLE_VALUE = "singleValue"
+
+APIGW_4XX_ROW = ("...", "4XXError", STAT_SUM)
+APIGW_LATENCY_ROW = ("...", "Latency", STAT_AVG)
+APIGW_COUNT_ROW = ("...", "Count", STAT_SUM)
+
+# Fixed layout shared by the SLO widgets; builders merge in "y" and
+# "properties" with the | operator.
+SLO_GRAPH_BASE = {"type": "metric", "x": 0, "width": 18, "height": 6}
+SLO_VALUE_BASE = {
+    "type": "metric",
+    "x": 18,
+    "width": 6,
+    "height": 6,
+    "properties": {"metrics": [["..."]], "view": VIEW_SINGLE_VALUE},
+}
+RESOURCE_HEADER_WIDGET = {
+    "type": "text",
+    "x": 0,
+    "width": 24,
+    "height": 1,
+    "properties": {"markdown": "--- \n ### **Individual Resource Metrics**"},
+}
+
+
+# Per-resource metric widget. Serialized through json_default() in the same
+# key order as the dict widgets.
+@dataclass(slots=True, frozen=True)
+class Widget:
+    y: int
+    metrics: Sequence
+    view: str
+    region: str
+    title: str
+    type: str = "metric"
+    x: int = 0
+    width: int = 24
+    height: int = 7
+
+    def to_dict(self):
+        return {
+            "type": self.type,
+            "x": self.x,
+            "width": self.width,
+            "height": self.height,
+            "y": self.y,
+            "properties": {
+                "metrics": self.metrics,
+                "view": self.view,
+                "region": self.region,
+                "title": self.title,
+            },
+        }
+
 
 def create_custom_widget(widget_def, region, y):
-    widget_def["y"] = y
-    if "properties" in widget_def:
-        widget_def["properties"]["region"] = region
-    return widget_def
+    # Copy rather than mutate: widget_def belongs to CUSTOM_WIDGET_DEFS, which
+    # is shared by every invocation in this container.
+    widget = {**widget_def, "y": y}
+    if "properties" in widget:
+        widget["properties"] = {**widget["properties"], "region": region}
+    return widget, widget.get("height", 7)
 
 
 def lambda_handler(event, context):
@@ -145,29 +301,10 @@ def lambda_handler(event, context):
     tag_key = os.environ["TAG_KEY"]
     tag_value = os.environ["TAG_VALUE"]
 
-    slo_target = float(os.environ.get("SLO_TARGET", 99.9))
-    cpu_slo_target = float(os.environ.get("CPU_SLO_TARGET", 80.0))
-    rds_cpu_slo_target = float(os.environ.get("RDS_CPU_SLO_TARGET", 80.0))
-    latency_slo_target_ms = float(os.environ.get("LATENCY_SLO_TARGET", 10.0))
-    latency_slo_target_s = latency_slo_target_ms / 1000.0
-
-    enabled_widget_keys = os.environ.get("ENABLED_WIDGETS").split(",")
-    SERVICE_CONFIG = {
-        key: ALL_SERVICES_CONFIG[key]
-        for key in enabled_widget_keys
-        if key in ALL_SERVICES_CONFIG
-    }
-
-    dimension_config_str = os.environ.get("DIMENSION_CONFIG", "{}")
-    try:
-        DIMENSION_CONFIG = json.loads(dimension_config_str)
-    except json.JSONDecodeError:
-        DIMENSION_CONFIG = {}
-
-    tagged_resources = get_tagged_resources(tag_key, tag_value, SERVICE_CONFIG)
+    tagged_resources = get_tagged_resources(tag_key, tag_value, RESOURCE_TYPE_FILTERS)
 
     if not tagged_resources:
-        update_dashboard(
+        return publish_dashboard(
             dashboard_name,
             [
                 {
@@ -181,213 +318,326 @@ def lambda_handler(event, context):
                     },
                 }
             ],
+            "No tagged resources found.",
         )
-        return {"statusCode": 200, "body": "No tagged resources found."}
 
     all_widgets, y_pos = [], 0
 
-    slo_resources = {
-        "alb": [r for r in tagged_resources if "loadbalancer/app" in r["ResourceARN"]],
-        "lambda": [r for r in tagged_resources if ":function:" in r["ResourceARN"]],
-        "cloudfront": [
-            r for r in tagged_resources if "distribution/" in r["ResourceARN"]
-        ],
-        "ec2": [r for r in tagged_resources if "instance/" in r["ResourceARN"]],
-        "rds": [r for r in tagged_resources if ":db:" in r["ResourceARN"]],
-    }
+    # Single pass over the tagged resources: parse each ARN's resource id once,
+    # bucket them for the SLO widgets and resolve the service config for the
+    # individual resource widgets.
+    slo_resources = {"alb": [], "lambda": [], "cloudfront": [], "ec2": [], "rds": []}
+    matched_resources = []
+    for resource in tagged_resources:
+        arn = resource["ResourceARN"]
+        resource["ResourceId"] = resource_id_from_arn(arn)
+        if "loadbalancer/app" in arn:
+            slo_resources["alb"].append(resource)
+        elif ":function:" in arn:
+            slo_resources["lambda"].append(resource)
+        elif "distribution/" in arn:
+            slo_resources["cloudfront"].append(resource)
+        elif "instance/" in arn:
+            slo_resources["ec2"].append(resource)
+        elif ":db:" in arn:
+            slo_resources["rds"].append(resource)
+        config = match_service_config(arn)
+        if config is not None:
+            matched_resources.append((arn, config))
+
+    gate_passed = check_slo_gates(slo_resources)
+    for bucket, builder, gate, args in SLO_JOBS:
+        if slo_resources[bucket] and gate_passed.get(bucket, True):
+            all_widgets.extend(builder(slo_resources[bucket], region, y_pos, *args))
+            y_pos += 6
 
-    if slo_resources["alb"]:
-        all_widgets.extend(
-            create_aggregate_alb_slo_widget(
-                slo_resources["alb"], region, y_pos, slo_target
-            )
-        )
-        y_pos += 6
-    if slo_resources["lambda"]:
-        all_widgets.extend(
-            create_aggregate_lambda_slo_widget(
-                slo_resources["lambda"], region, y_pos, slo_target
-            )
-        )
-        y_pos += 6
-    if slo_resources["cloudfront"]:
-        all_widgets.extend(
-            create_aggregate_cloudfront_slo_widget(
-                slo_resources["cloudfront"], region, y_pos, slo_target
-            )
-        )
-        y_pos += 6
-    if slo_resources["ec2"] and metrics_exist_for_resources(
-        "AWS/EC2", "CPUUtilization", "InstanceId", slo_resources["ec2"]
-    ):
-        all_widgets.extend(
-            create_aggregate_ec2_slo_widget(
-                slo_resources["ec2"], region, y_pos, cpu_slo_target
-            )
-        )
-        y_pos += 6
-    if slo_resources["rds"] and metrics_exist_for_resources(
-        "AWS/RDS", "ReadLatency", "DBInstanceIdentifier", slo_resources["rds"]
-    ):
-        all_widgets.extend(
-            create_aggregate_rds_slo_widget(
-                slo_resources["rds"],
-                region,
-                y_pos,
-                latency_slo_target_s,
-                rds_cpu_slo_target,
-                latency_slo_target_ms,
+    if all_widgets:
+        all_widgets.append(RESOURCE_HEADER_WIDGET | {"y": y_pos})
+        y_pos += RESOURCE_HEADER_WIDGET["height"]
+
+    if "ec2_instance" in SERVICE_CONFIG:
+        prefetch_agent_metrics([r["ResourceId"] for r in slo_resources["ec2"]])
+
+    work_items = sorted(matched_resources, key=itemgetter(0))
+    if len(work_items) > PARALLEL_BUILD_THRESHOLD:
+        with ThreadPoolExecutor(max_workers=BUILD_WORKERS) as executor:
+            resource_widgets = list(
+                executor.map(
+                    lambda item: build_resource_widget(*item, region), work_items
+                )
             )
-        )
-        y_pos += 6
+    else:
+        resource_widgets = [
+            build_resource_widget(arn, config, region) for arn, config in work_items
+        ]
+    # Layout stays sequential: each widget's y depends on the heights above it.
+    for widget in resource_widgets:
+        if widget:
+            all_widgets.append(replace(widget, y=y_pos))
+            y_pos += widget.height
+
+    for widget_def in CUSTOM_WIDGET_DEFS:
+        custom_widget, height = create_custom_widget(widget_def, region, y_pos)
+        all_widgets.append(custom_widget)
+        y_pos += height
+
+    save_metrics_cache()
+    return publish_dashboard(
+        dashboard_name,
+        all_widgets,
+        f"Dashboard updated successfully with {len(all_widgets)} widgets.",
+    )
 
-    if all_widgets:
-        all_widgets.append(
-            {
-                "type": "text",
-                "x": 0,
-                "y": y_pos,
-                "width": 24,
-                "height": 1,
-                "properties": {
-                    "markdown": "--- \n ### **Individual Resource Metrics**"
-                },
-            }
-        )
-        y_pos += 1
 
-    sorted_resources = sorted(tagged_resources, key=lambda r: r["ResourceARN"])
-    for resource in sorted_resources:
-        arn = resource["ResourceARN"]
-        matched_configs = [c for c in SERVICE_CONFIG.values() if c["id"] in arn]
-        if not matched_configs:
-            continue
-        best_match_config = max(matched_configs, key=lambda c: len(c["id"]))
-        try:
-            if (
-                best_match_config["builder"] == "create_classic_elb_widget"
-                and "loadbalancer/" in arn
-            ):
-                continue
-            is_global = best_match_config.get("is_global", False)
-            widget_func = globals()[best_match_config["builder"]]
-            widget = widget_func(
-                arn, region if not is_global else "us-east-1", y_pos, DIMENSION_CONFIG
-            )
-            if widget:
-                all_widgets.append(widget)
-                y_pos += widget.get("height", 7)
-        except Exception as e:
-            print(
-                f"ERROR: Could not create widget for ARN {arn}. Builder: {best_match_config['builder']}. Details: {e}"
-            )
+def publish_dashboard(dashboard_name, widgets, updated_body):
+    try:
+        written = update_dashboard(dashboard_name, widgets)
+    except ClientError:
+        return {
+            "statusCode": 500,
+            "body": f"Could not update dashboard '{dashboard_name}'.",
+        }
+    if not written:
+        return {
+            "statusCode": 200,
+            "body": f"Dashboard '{dashboard_name}' is unchanged. Skipped update.",
+        }
+    return {"statusCode": 200, "body": updated_body}
+
 
-    custom_widgets_json = os.environ.get("CUSTOM_WIDGETS_CONFIG", "[]")
+# Builders other than the "is_dynamic" ones depend only on the ARN, region
+# and the module-level DIMENSION_CONFIG, so their widgets are kept across warm
+# invocations and only re-stamped with "y". Widget is frozen, so the cached
+# objects are shared safely; the caller copies them with replace().
+@lru_cache(maxsize=4096)
+def build_static_widget(builder, arn, region):
+    return builder(arn, region, 0)
+
+
+def build_resource_widget(arn, config, region):
     try:
-        custom_widget_defs = json.loads(custom_widgets_json)
-        for widget_def in custom_widget_defs:
-            custom_widget = create_custom_widget(widget_def, region, y_pos)
-            if custom_widget:
-                all_widgets.append(custom_widget)
-                y_pos += widget_def.get("height", 7)
-    except json.JSONDecodeError:
-        print(
-            f"WARN: Could not parse CUSTOM_WIDGETS_CONFIG. Invalid JSON: {custom_widgets_json}"
+        widget_region = config["fixed_region"] or region
+        if config.get("is_dynamic", False):
+            return config["builder"](arn, widget_region, 0)
+        return build_static_widget(config["builder"], arn, widget_region)
+    except Exception as e:
+        logger.error(
+            "Could not create widget for ARN %s. Builder: %s. Details: %s",
+            arn,
+            config["builder"].__name__,
+            e,
         )
+        return None
 
-    update_dashboard(dashboard_name, all_widgets)
-    return {
-        "statusCode": 200,
-        "body": f"Dashboard updated successfully with {len(all_widgets)} widgets.",
-    }
+
+# The enabled configs are fixed for the container's lifetime, so an ARN seen
+# on an earlier warm invocation skips the substring scan entirely.
+@lru_cache(maxsize=4096)
+def match_service_config(arn):
+    if arn.startswith(PREFIX_IDS):
+        return next(c for c in PREFIX_CONFIGS if arn.startswith(c["id"]))
+    return next(
+        (
+            c
+            for c in SUBSTRING_CONFIGS
+            if c["id"] in arn and not any(x in arn for x in c.get("exclude_ids", ()))
+        ),
+        None,
+    )
 
 
-def get_tagged_resources(tag_key, tag_value, service_config):
-    tagging_client = boto3.client("resourcegroupstaggingapi", config=retry_config)
-    resources, token = [], ""
-    filters = list(set([svc["filter"] for svc in service_config.values()]))
-    while True:
-        try:
-            response = tagging_client.get_resources(
-                TagFilters=[{"Key": tag_key, "Values": [tag_value]}],
-                ResourceTypeFilters=filters,
-                PaginationToken=token,
+def get_tagged_resources(tag_key, tag_value, filters):
+    tag_filters = [{"Key": tag_key, "Values": [tag_value]}]
+    shards = [
+        filters[i : i + TAG_FILTER_SHARD_SIZE]
+        for i in range(0, len(filters), TAG_FILTER_SHARD_SIZE)
+    ] or [filters]
+    try:
+        with ThreadPoolExecutor(
+            max_workers=min(TAG_DISCOVERY_WORKERS, len(shards))
+        ) as executor:
+            pages = list(
+                executor.map(
+                    lambda shard: get_resources_for_filters(tag_filters, shard),
+                    shards,
+                )
             )
-            resources.extend(response["ResourceTagMappingList"])
-            token = response.get("PaginationToken", "")
-            if not token:
-                break
-        except ClientError as e:
-            return []
-    return resources
+    except ClientError as e:
+        logger.error("Could not list resources tagged %s:%s. %s", tag_key, tag_value, e)
+        raise
+    # Shards never share a filter, but dedupe by ARN in case types overlap.
+    return list({r["ResourceARN"]: r for page in pages for r in page}.values())
 
 
+def get_resources_for_filters(tag_filters, resource_type_filters):
+    paginator = tagging_client.get_paginator("get_resources")
+    pages = paginator.paginate(
+        TagFilters=tag_filters, ResourceTypeFilters=resource_type_filters
+    )
+    return list(chain.from_iterable(page["ResourceTagMappingList"] for page in pages))
+
+
+def json_default(obj):
+    if isinstance(obj, Widget):
+        return obj.to_dict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_dashboard_body(dashboard_body):
+    if orjson is not None:
+        # orjson would otherwise flatten Widget by its fields on its own.
+        return orjson.dumps(
+            dashboard_body,
+            default=json_default,
+            option=orjson.OPT_PASSTHROUGH_DATACLASS,
+        ).decode()
+    return json.dumps(
+        dashboard_body, separators=(",", ":"), ensure_ascii=False, default=json_default
+    )
+
+
+# Returns True if PutDashboard wrote the body, False if it was skipped as
+# unchanged. A failed put is logged and re-raised.
 def update_dashboard(dashboard_name, widgets):
+    body = dumps_dashboard_body({"widgets": widgets})
+    digest = hashlib.blake2b(
+        f"{dashboard_name}\n{body}".encode(), digest_size=16
+    ).hexdigest()
+    global last_dashboard_digest
+    if digest == last_dashboard_digest:
+        logger.info("Dashboard '%s' is unchanged. Skipping.", dashboard_name)
+        return False
     try:
         cloudwatch_client.put_dashboard(
-            DashboardName=dashboard_name, DashboardBody=json.dumps({"widgets": widgets})
+            DashboardName=dashboard_name, DashboardBody=body
         )
     except ClientError as e:
-        print(f"FATAL: Could not update dashboard '{dashboard_name}': {e}")
+        logger.critical("Could not update dashboard '%s': %s", dashboard_name, e)
+        raise
+    last_dashboard_digest = digest
+    return True
+
+
+def cache_get(key):
+    entry = metrics_cache.get(key)
+    if entry and time.time() - entry[0] < METRICS_CACHE_TTL:
+        return entry[1]
+    return None
+
+
+def cache_put(key, value):
+    metrics_cache[key] = [time.time(), value]
+
+
+def save_metrics_cache():
+    now = time.time()
+    for key in [k for k, v in metrics_cache.items() if now - v[0] >= METRICS_CACHE_TTL]:
+        del metrics_cache[key]
+    try:
+        with open(METRICS_CACHE_FILE, "w") as f:
+            json.dump(metrics_cache, f)
+    except OSError as e:
+        logger.warning("Could not write metrics cache to %s. %s", METRICS_CACHE_FILE, e)
+
+
+def check_slo_gates(slo_resources):
+    gated = [(b, g) for b, _, g, _ in SLO_JOBS if g and slo_resources[b]]
+    if not gated:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(gated)) as executor:
+        results = executor.map(
+            lambda job: metrics_exist_for_resources(*job[1], slo_resources[job[0]]),
+            gated,
+        )
+        return {bucket: passed for (bucket, _), passed in zip(gated, results)}
+
+
+def resource_id_from_arn(arn):
+    return arn.rpartition(":")[2].rpartition("/")[2]
 
 
 def metrics_exist_for_resources(namespace, metric_name, dimension_key, resources):
+    # One GetMetricData query per resource, batched, over a short lookback: any
+    # query that returns a datapoint proves the metric is live. Per-resource
+    # answers are cached so warm runs only ask about resources not seen yet.
+    key_prefix = f"{namespace}:{metric_name}:{dimension_key}:"
+    resource_ids = {r["ResourceId"] for r in resources}
+    known = {i: cache_get(key_prefix + i) for i in resource_ids}
+    found = any(known.values())
+    unknown = sorted(i for i, has_data in known.items() if has_data is None)
+    # Align the window to period boundaries, as GetMetricData recommends.
+    end_time = datetime.fromtimestamp(
+        (time.time() // METRIC_DATA_PERIOD + 1) * METRIC_DATA_PERIOD, timezone.utc
+    )
+    start_time = end_time - timedelta(seconds=METRIC_LOOKBACK_SECONDS)
     try:
-        paginator = cloudwatch_client.get_paginator("list_metrics")
-        for resource in resources:
-            instance_id = resource["ResourceARN"].split(":")[-1].split("/")[-1]
-            pages = paginator.paginate(
-                Namespace=namespace,
-                MetricName=metric_name,
-                Dimensions=[{"Name": dimension_key, "Value": instance_id}],
+        for start in range(0, len(unknown), METRIC_DATA_BATCH_SIZE):
+            if found:
+                break
+            batch = unknown[start : start + METRIC_DATA_BATCH_SIZE]
+            response = cloudwatch_client.get_metric_data(
+                MetricDataQueries=[
+                    {
+                        "Id": f"m{i}",
+                        "MetricStat": {
+                            "Metric": {
+                                "Namespace": namespace,
+                                "MetricName": metric_name,
+                                "Dimensions": [
+                                    {"Name": dimension_key, "Value": resource_id}
+                                ],
+                            },
+                            "Period": METRIC_DATA_PERIOD,
+                            "Stat": "SampleCount",
+                        },
+                        "ReturnData": True,
+                    }
+                    for i, resource_id in enumerate(batch)
+                ],
+                StartTime=start_time,
+                EndTime=end_time,
             )
-            for page in pages:
-                if page["Metrics"]:
-                    print(f"INFO: Found metric '{metric_name}' for SLO widget.")
-                    return True
+            for result in response["MetricDataResults"]:
+                has_data = bool(result["Values"])
+                cache_put(key_prefix + batch[int(result["Id"][1:])], has_data)
+                found = found or has_data
     except ClientError as e:
-        print(f"WARN: Error checking for metric '{metric_name}'. {e}")
+        logger.warning("Error checking for metric '%s'. %s", metric_name, e)
         return False
-    print(f"INFO: No metrics found for '{metric_name}' in the given resources.")
+    if found:
+        logger.info("Found metric '%s' for SLO widget.", metric_name)
+        return True
+    logger.info("No metrics found for '%s' in the given resources.", metric_name)
     return False
 
 
 def create_aggregate_alb_slo_widget(resources, region, y, slo_target):
-    metrics = []
-    for i, res in enumerate(resources):
-        lb_name = "/".join(res["ResourceARN"].split("/")[-3:])
-        metrics.extend(
-            [
-                {
-                    "id": f"r{i}",
-                    "visible": False,
-                    "expression": f"SEARCH('{{AWS/ApplicationELB,LoadBalancer}}MetricName=\"RequestCount\" \"{lb_name}\"' ,'Sum',300)",
-                },
-                {
-                    "id": f"e{i}",
-                    "visible": False,
-                    "expression": f"SEARCH('{{AWS/ApplicationELB,LoadBalancer}}MetricName=\"HTTPCode_Target_5XX_Count\" \"{lb_name}\"' ,'Sum',300)",
-                },
-            ]
-        )
-    total_requests_expression = f"SUM([r{i} for i in range(len(resources))])"
-    total_errors_expression = f"SUM([e{i} for i in range(len(resources))])"
-    metrics.append(
+    lb_names = ("/".join(res["ResourceARN"].rsplit("/", 3)[-3:]) for res in resources)
+    search_expression = " OR ".join(f'"{lb_name}"' for lb_name in lb_names)
+    metrics = [
+        {
+            "id": "requests",
+            "expression": f"SEARCH('{{AWS/ApplicationELB,LoadBalancer}}MetricName=\"RequestCount\"({search_expression})','Sum',300)",
+            "visible": False,
+        },
+        {
+            "id": "errors",
+            "expression": f"SEARCH('{{AWS/ApplicationELB,LoadBalancer}}MetricName=\"HTTPCode_Target_5XX_Count\"({search_expression})','Sum',300)",
+            "visible": False,
+        },
         {
             "id": "slo",
-            "expression": f"100*(1-({total_errors_expression})/({total_requests_expression}+0.000001))",
+            "expression": "100*(1-SUM(errors)/(SUM(requests)+0.000001))",
             "label": "Availability %",
-        }
-    )
-    slo_graph = {
-        "type": "metric",
-        "x": 0,
+        },
+    ]
+    slo_graph = SLO_GRAPH_BASE | {
         "y": y,
-        "width": 18,
-        "height": 6,
         "properties": {
             "metrics": metrics,
-            "view": "timeSeries",
+            "view": VIEW_TIME_SERIES,
             "region": region,
             "title": "ALB Availability SLO",
             "yAxis": {"left": {"min": 95, "max": 100}},
@@ -402,29 +652,16 @@ def create_aggregate_alb_slo_widget(resources, region, y, slo_target):
             },
         },
     }
-    slo_value = {
-        "type": "metric",
-        "x": 18,
+    slo_value = SLO_VALUE_BASE | {
         "y": y,
-        "width": 6,
-        "height": 6,
-        "properties": {
-            "metrics": [["..."]],
-            "view": "singleValue",
-            "region": region,
-            "title": "Current Availability",
-        },
+        "properties": SLO_VALUE_BASE["properties"]
+        | {"region": region, "title": "Current Availability"},
     }
     return [slo_graph, slo_value]
 
 
 def create_aggregate_lambda_slo_widget(resources, region, y, slo_target):
-    search_expression = " OR ".join(
-        [
-            f'"{name}"'
-            for name in [res["ResourceARN"].split(":")[-1] for res in resources]
-        ]
-    )
+    search_expression = " OR ".join(f'"{res["ResourceId"]}"' for res in resources)
     metrics = [
         {
             "id": "invocations",
@@ -442,15 +679,11 @@ def create_aggregate_lambda_slo_widget(resources, region, y, slo_target):
             "label": "Success Rate %",
         },
     ]
-    slo_graph = {
-        "type": "metric",
-        "x": 0,
+    slo_graph = SLO_GRAPH_BASE | {
         "y": y,
-        "width": 18,
-        "height": 6,
         "properties": {
             "metrics": metrics,
-            "view": "timeSeries",
+            "view": VIEW_TIME_SERIES,
             "region": region,
             "title": "Lambda Success Rate SLO",
             "yAxis": {"left": {"min": 95, "max": 100}},
@@ -465,29 +698,16 @@ def create_aggregate_lambda_slo_widget(resources, region, y, slo_target):
             },
         },
     }
-    slo_value = {
-        "type": "metric",
-        "x": 18,
+    slo_value = SLO_VALUE_BASE | {
         "y": y,
-        "width": 6,
-        "height": 6,
-        "properties": {
-            "metrics": [["..."]],
-            "view": "singleValue",
-            "region": region,
-            "title": "Current Success Rate",
-        },
+        "properties": SLO_VALUE_BASE["properties"]
+        | {"region": region, "title": "Current Success Rate"},
     }
     return [slo_graph, slo_value]
 
 
 def create_aggregate_cloudfront_slo_widget(resources, region, y, slo_target):
-    search_expression = " OR ".join(
-        [
-            f'"{dist_id}"'
-            for dist_id in [res["ResourceARN"].split("/")[-1] for res in resources]
-        ]
-    )
+    search_expression = " OR ".join(f'"{res["ResourceId"]}"' for res in resources)
     metrics = [
         {
             "id": "error_rate",
@@ -496,15 +716,11 @@ def create_aggregate_cloudfront_slo_widget(resources, region, y, slo_target):
         },
         {"id": "slo", "expression": "100-error_rate", "label": "Success Rate %"},
     ]
-    slo_graph = {
-        "type": "metric",
-        "x": 0,
+    slo_graph = SLO_GRAPH_BASE | {
         "y": y,
-        "width": 18,
-        "height": 6,
         "properties": {
             "metrics": metrics,
-            "view": "timeSeries",
+            "view": VIEW_TIME_SERIES,
             "region": "us-east-1",
             "title": "CloudFront Success Rate SLO",
             "yAxis": {"left": {"min": 95, "max": 100}},
@@ -519,26 +735,16 @@ def create_aggregate_cloudfront_slo_widget(resources, region, y, slo_target):
             },
         },
     }
-    slo_value = {
-        "type": "metric",
-        "x": 18,
+    slo_value = SLO_VALUE_BASE | {
         "y": y,
-        "width": 6,
-        "height": 6,
-        "properties": {
-            "metrics": [["..."]],
-            "view": "singleValue",
-            "region": "us-east-1",
-            "title": "Current Success Rate",
-        },
+        "properties": SLO_VALUE_BASE["properties"]
+        | {"region": "us-east-1", "title": "Current Success Rate"},
     }
     return [slo_graph, slo_value]
 
 
 def create_aggregate_ec2_slo_widget(resources, region, y, slo_target):
-    search_expression = " OR ".join(
-        [f'"{res["ResourceARN"].split("/")[-1]}"' for res in resources]
-    )
+    search_expression = " OR ".join(f'"{res["ResourceId"]}"' for res in resources)
     metrics = [
         {
             "id": "avg_cpu",
@@ -556,32 +762,20 @@ def create_aggregate_ec2_slo_widget(resources, region, y, slo_target):
             "label": "Performance SLO Met %",
         },
     ]
-    slo_graph = {
-        "type": "metric",
-        "x": 0,
+    slo_graph = SLO_GRAPH_BASE | {
         "y": y,
-        "width": 18,
-        "height": 6,
         "properties": {
             "metrics": metrics,
-            "view": "timeSeries",
+            "view": VIEW_TIME_SERIES,
             "region": region,
             "title": f"EC2 Perf. SLO (CPU & Mem < {slo_target}%)",
             "yAxis": {"left": {"min": 0, "max": 105}},
         },
     }
-    slo_value = {
-        "type": "metric",
-        "x": 18,
+    slo_value = SLO_VALUE_BASE | {
         "y": y,
-        "width": 6,
-        "height": 6,
-        "properties": {
-            "metrics": [["..."]],
-            "view": "singleValue",
-            "region": region,
-            "title": "Current Performance",
-        },
+        "properties": SLO_VALUE_BASE["properties"]
+        | {"region": region, "title": "Current Performance"},
     }
     return [slo_graph, slo_value]
 
@@ -589,9 +783,7 @@ def create_aggregate_ec2_slo_widget(resources, region, y, slo_target):
 def create_aggregate_rds_slo_widget(
     resources, region, y, latency_target_s, cpu_target, latency_target_ms
 ):
-    search_expression = " OR ".join(
-        [f'"{res["ResourceARN"].split(":")[-1]}"' for res in resources]
-    )
+    search_expression = " OR ".join(f'"{res["ResourceId"]}"' for res in resources)
     metrics = [
         {
             "id": "avg_latency",
@@ -609,638 +801,618 @@ def create_aggregate_rds_slo_widget(
             "label": "Performance SLO Met %",
         },
     ]
-    slo_graph = {
-        "type": "metric",
-        "x": 0,
+    slo_graph = SLO_GRAPH_BASE | {
         "y": y,
-        "width": 18,
-        "height": 6,
         "properties": {
             "metrics": metrics,
-            "view": "timeSeries",
+            "view": VIEW_TIME_SERIES,
             "region": region,
             "title": f"RDS Perf. SLO (Latency < {latency_target_ms}ms & CPU < {cpu_target}%)",
             "yAxis": {"left": {"min": 0, "max": 105}},
         },
     }
-    slo_value = {
-        "type": "metric",
-        "x": 18,
+    slo_value = SLO_VALUE_BASE | {
         "y": y,
-        "width": 6,
-        "height": 6,
-        "properties": {
-            "metrics": [["..."]],
-            "view": "singleValue",
-            "region": region,
-            "title": "Current Performance",
-        },
+        "properties": SLO_VALUE_BASE["properties"]
+        | {"region": region, "title": "Current Performance"},
     }
     return [slo_graph, slo_value]
 
 
-def create_ec2_hybrid_widget(arn, region, y, dimension_config):
-    instance_id = arn.split("/")[-1]
+def create_ec2_hybrid_widget(arn, region, y):
+    instance_id = resource_id_from_arn(arn)
     try:
         agent_widget = create_dynamic_agent_widget(instance_id, region, y)
         if agent_widget:
-            print(
-                f"INFO: CWAgent metrics found for instance {instance_id}. Building dynamic agent widget."
+            logger.info(
+                "CWAgent metrics found for instance %s. Building dynamic agent widget.",
+                instance_id,
             )
             return agent_widget
     except Exception as e:
-        print(
-            f"INFO: Could not build dynamic agent widget for {instance_id}. Defaulting to standard. Error: {e}"
+        logger.warning(
+            "Could not build dynamic agent widget for %s. Defaulting to standard. Error: %s",
+            instance_id,
+            e,
         )
-    print(
-        f"INFO: CWAgent not detected for {instance_id}. Building standard agentless widget."
+    logger.info(
+        "CWAgent not detected for %s. Building standard agentless widget.",
+        instance_id,
     )
     return create_standard_ec2_widget(instance_id, region, y)
 
 
-def create_dynamic_agent_widget(instance_id, region, y):
-    metrics_to_add = []
+def agent_metric_row(metric):
+    row = ["CWAgent", metric["MetricName"]]
+    for dim in metric["Dimensions"]:
+        row.append(dim["Name"])
+        row.append(dim["Value"])
+    return row
+
+
+def fetch_agent_metrics(instance_id):
+    # ListMetrics has no MaxResults, so there is no cheaper existence probe: an
+    # instance without the agent already costs a single empty page, and that
+    # empty result is cached like any other so warm runs skip the call.
     try:
         paginator = cloudwatch_client.get_paginator("list_metrics")
         pages = paginator.paginate(
             Namespace="CWAgent",
             Dimensions=[{"Name": "InstanceId", "Value": instance_id}],
         )
-        for page in pages:
+        return [
+            agent_metric_row(metric) for page in pages for metric in page["Metrics"]
+        ]
+    except ClientError as e:
+        logger.error("Could not list CWAgent metrics for %s. %s", instance_id, e)
+        return None
+
+
+def fetch_agent_metrics_index():
+    # One scan of the whole CWAgent namespace, grouped by InstanceId, instead
+    # of a ListMetrics call per instance.
+    index = {}
+    try:
+        paginator = cloudwatch_client.get_paginator("list_metrics")
+        for page in paginator.paginate(Namespace="CWAgent"):
             for metric in page["Metrics"]:
-                metric_entry = ["CWAgent", metric["MetricName"]]
                 for dim in metric["Dimensions"]:
-                    metric_entry.append(dim["Name"])
-                    metric_entry.append(dim["Value"])
-                metrics_to_add.append(metric_entry)
-        if not metrics_to_add:
-            return None
+                    if dim["Name"] == "InstanceId":
+                        index.setdefault(dim["Value"], []).append(
+                            agent_metric_row(metric)
+                        )
+                        break
     except ClientError as e:
-        print(f"ERROR: Could not list CWAgent metrics for {instance_id}. {e}")
+        logger.error("Could not list CWAgent metrics. %s", e)
         return None
-    metrics_to_add.append(
-        ["AWS/EC2", "StatusCheckFailed", "InstanceId", instance_id, {"stat": "Maximum"}]
+    return index
+
+
+def prefetch_agent_metrics(instance_ids):
+    stale = [i for i in instance_ids if cache_get(f"CWAgent:{i}") is None]
+    if not stale:
+        return
+    # A namespace scan pages through every CWAgent metric in the account, so
+    # it only beats per-instance ListMetrics calls once enough are stale.
+    if len(stale) <= AGENT_INDEX_SCAN_THRESHOLD:
+        with ThreadPoolExecutor(max_workers=min(BUILD_WORKERS, len(stale))) as executor:
+            for instance_id, metrics in zip(
+                stale, executor.map(fetch_agent_metrics, stale)
+            ):
+                if metrics is not None:
+                    cache_put(f"CWAgent:{instance_id}", metrics)
+        return
+    index = fetch_agent_metrics_index()
+    if index is None:
+        return
+    for instance_id in stale:
+        cache_put(f"CWAgent:{instance_id}", index.get(instance_id, []))
+
+
+def create_dynamic_agent_widget(instance_id, region, y):
+    metrics_to_add = cache_get(f"CWAgent:{instance_id}")
+    if metrics_to_add is None:
+        metrics_to_add = fetch_agent_metrics(instance_id)
+        if metrics_to_add is not None:
+            cache_put(f"CWAgent:{instance_id}", metrics_to_add)
+    if not metrics_to_add:
+        return None
+    metrics_to_add = metrics_to_add + [
+        ["AWS/EC2", "StatusCheckFailed", "InstanceId", instance_id, STAT_MAX]
+    ]
+    return Widget(
+        y,
+        metrics_to_add,
+        VIEW_TIME_SERIES,
+        region,
+        "EC2 Detailed (Auto-Discovered): " + instance_id,
     )
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": metrics_to_add,
-            "view": "timeSeries",
-            "region": region,
-            "title": f"EC2 Detailed (Auto-Discovered): {instance_id}",
-        },
-    }
 
 
 def create_standard_ec2_widget(instance_id, region, y):
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/EC2", "CPUUtilization", "InstanceId", instance_id],
-                [
-                    "...",
-                    "StatusCheckFailed",
-                    "InstanceId",
-                    instance_id,
-                    {"stat": "Maximum"},
-                ],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"EC2 Standard: {instance_id}",
-        },
-    }
+    return Widget(
+        y,
+        (
+            ("AWS/EC2", "CPUUtilization", "InstanceId", instance_id),
+            (
+                "...",
+                "StatusCheckFailed",
+                "InstanceId",
+                instance_id,
+                STAT_MAX,
+            ),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "EC2 Standard: " + instance_id,
+    )
 
 
-def create_rds_detailed_widget(arn, region, y, dimension_config):
-    db = arn.split(":")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/RDS", "CPUUtilization", "DBInstanceIdentifier", db],
-                ["...", "DatabaseConnections"],
-                ["...", "FreeableMemory"],
-                ["...", "ReadLatency"],
-                ["...", "WriteLatency"],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"RDS Detailed: {db}",
-        },
-    }
+def create_rds_detailed_widget(arn, region, y):
+    db = arn.rpartition(":")[2]
+    return Widget(
+        y,
+        (
+            ("AWS/RDS", "CPUUtilization", "DBInstanceIdentifier", db),
+            ("...", "DatabaseConnections"),
+            ("...", "FreeableMemory"),
+            ("...", "ReadLatency"),
+            ("...", "WriteLatency"),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "RDS Detailed: " + db,
+    )
 
 
-def create_lambda_widget(arn, region, y, dimension_config):
-    fn = arn.split(":")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/Lambda", "Errors", "FunctionName", fn, {"stat": "Sum"}],
-                ["...", "Throttles", {"stat": "Sum"}],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"Lambda: {fn}",
-        },
-    }
+def create_lambda_widget(arn, region, y):
+    fn = arn.rpartition(":")[2]
+    return Widget(
+        y,
+        (
+            ("AWS/Lambda", "Errors", "FunctionName", fn, STAT_SUM),
+            ("...", "Throttles", STAT_SUM),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "Lambda: " + fn,
+    )
 
 
-def create_alb_widget(arn, region, y, dimension_config):
-    lb = "/".join(arn.split("/")[-3:])
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/ApplicationELB",
-                    "HTTPCode_Target_5XX_Count",
-                    "LoadBalancer",
-                    lb,
-                    {"stat": "Sum"},
-                ],
-                ["...", "TargetResponseTime", {"stat": "Average"}],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"ALB: {lb.split('/')[1]}",
-        },
-    }
+def create_alb_widget(arn, region, y):
+    parts = arn.rsplit("/", 3)
+    lb = "/".join(parts[-3:])
+    return Widget(
+        y,
+        (
+            (
+                "AWS/ApplicationELB",
+                "HTTPCode_Target_5XX_Count",
+                "LoadBalancer",
+                lb,
+                STAT_SUM,
+            ),
+            ("...", "TargetResponseTime", STAT_AVG),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "ALB: " + parts[-2],
+    )
 
 
-def create_nlb_widget(arn, region, y, dimension_config):
-    lb = "/".join(arn.split("/")[-3:])
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/NetworkELB", "UnHealthyHostCount", "LoadBalancer", lb],
-                ["...", "TCP_Target_Reset_Count", {"stat": "Sum"}],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"NLB: {lb.split('/')[1]}",
-        },
-    }
+def create_nlb_widget(arn, region, y):
+    parts = arn.rsplit("/", 3)
+    lb = "/".join(parts[-3:])
+    return Widget(
+        y,
+        (
+            ("AWS/NetworkELB", "UnHealthyHostCount", "LoadBalancer", lb),
+            ("...", "TCP_Target_Reset_Count", STAT_SUM),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "NLB: " + parts[-2],
+    )
 
 
-def create_classic_elb_widget(arn, region, y, dimension_config):
-    lb = arn.split(":")[-1].split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/ELB",
-                    "HTTPCode_Backend_5XX",
-                    "LoadBalancerName",
-                    lb,
-                    {"stat": "Sum"},
-                ],
-                ["...", "UnHealthyHostCount"],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"Classic ELB: {lb}",
-        },
-    }
+def create_classic_elb_widget(arn, region, y):
+    lb = arn.rpartition(":")[2].rpartition("/")[2]
+    return Widget(
+        y,
+        (
+            (
+                "AWS/ELB",
+                "HTTPCode_Backend_5XX",
+                "LoadBalancerName",
+                lb,
+                STAT_SUM,
+            ),
+            ("...", "UnHealthyHostCount"),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "Classic ELB: " + lb,
+    )
 
 
-def create_ecs_widget(arn, r, y, dimension_config):
-    p = arn.split("/")
+def create_ecs_widget(arn, r, y):
+    p = arn.rsplit("/", 2)
     c, s = p[-2], p[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/ECS", "CPUUtilization", "ClusterName", c, "ServiceName", s],
-                ["...", "MemoryUtilization"],
-            ],
-            "view": "timeSeries",
-            "region": r,
-            "title": f"ECS: {c}/{s}",
-        },
-    }
+    return Widget(
+        y,
+        (
+            ("AWS/ECS", "CPUUtilization", "ClusterName", c, "ServiceName", s),
+            ("...", "MemoryUtilization"),
+        ),
+        VIEW_TIME_SERIES,
+        r,
+        f"ECS: {c}/{s}",
+    )
 
 
-def create_eks_widget(arn, r, y, dimension_config):
-    cluster_name = arn.split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "ContainerInsights",
-                    "node_cpu_utilization",
-                    "ClusterName",
-                    cluster_name,
-                ],
-                ["...", "node_memory_utilization"],
-            ],
-            "view": "timeSeries",
-            "region": r,
-            "title": f"EKS Cluster: {cluster_name}",
-        },
-    }
+def create_eks_widget(arn, r, y):
+    cluster_name = arn.rpartition("/")[2]
+    return Widget(
+        y,
+        (
+            (
+                "ContainerInsights",
+                "node_cpu_utilization",
+                "ClusterName",
+                cluster_name,
+            ),
+            ("...", "node_memory_utilization"),
+        ),
+        VIEW_TIME_SERIES,
+        r,
+        "EKS Cluster: " + cluster_name,
+    )
 
 
-def create_dynamodb_widget(arn, region, y, dimension_config):
-    tbl = arn.split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/DynamoDB",
-                    "ThrottledRequests",
-                    "TableName",
-                    tbl,
-                    {"stat": "Sum"},
-                ],
-                ["...", "SuccessfulRequestLatency", "TableName", tbl],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"DynamoDB: {tbl}",
-        },
-    }
+def create_dynamodb_widget(arn, region, y):
+    tbl = arn.rpartition("/")[2]
+    return Widget(
+        y,
+        (
+            (
+                "AWS/DynamoDB",
+                "ThrottledRequests",
+                "TableName",
+                tbl,
+                STAT_SUM,
+            ),
+            ("...", "SuccessfulRequestLatency", "TableName", tbl),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "DynamoDB: " + tbl,
+    )
 
 
-def create_redshift_widget(arn, region, y, dimension_config):
-    c = arn.split(":")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/Redshift", "CPUUtilization", "ClusterIdentifier", c],
-                ["...", "PercentageDiskSpaceUsed"],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"Redshift: {c}",
-        },
-    }
+def create_redshift_widget(arn, region, y):
+    c = arn.rpartition(":")[2]
+    return Widget(
+        y,
+        (
+            ("AWS/Redshift", "CPUUtilization", "ClusterIdentifier", c),
+            ("...", "PercentageDiskSpaceUsed"),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "Redshift: " + c,
+    )
 
 
-def create_sqs_widget(arn, region, y, dimension_config):
-    q = arn.split(":")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/SQS", "ApproximateAgeOfOldestMessage", "QueueName", q],
-                ["...", "ApproximateNumberOfMessagesVisible"],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"SQS Queue: {q}",
-        },
-    }
+def create_sqs_widget(arn, region, y):
+    q = arn.rpartition(":")[2]
+    return Widget(
+        y,
+        (
+            ("AWS/SQS", "ApproximateAgeOfOldestMessage", "QueueName", q),
+            ("...", "ApproximateNumberOfMessagesVisible"),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "SQS Queue: " + q,
+    )
 
 
-def create_sns_widget(arn, region, y, dimension_config):
-    t = arn.split(":")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/SNS",
-                    "NumberOfNotificationsFailed",
-                    "TopicName",
-                    t,
-                    {"stat": "Sum"},
-                ]
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"SNS Topic: {t}",
-        },
-    }
+def create_sns_widget(arn, region, y):
+    t = arn.rpartition(":")[2]
+    return Widget(
+        y,
+        (
+            (
+                "AWS/SNS",
+                "NumberOfNotificationsFailed",
+                "TopicName",
+                t,
+                STAT_SUM,
+            ),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "SNS Topic: " + t,
+    )
 
 
-def create_cloudfront_widget(arn, r, y, dimension_config):
-    dist_id = arn.split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/CloudFront",
-                    "5xxErrorRate",
-                    "Region",
-                    "Global",
-                    "DistributionId",
-                    dist_id,
-                ]
-            ],
-            "view": "timeSeries",
-            "region": r,
-            "title": f"CloudFront 5xx: {dist_id}",
-        },
-    }
+def create_cloudfront_widget(arn, r, y):
+    dist_id = arn.rpartition("/")[2]
+    return Widget(
+        y,
+        (
+            (
+                "AWS/CloudFront",
+                "5xxErrorRate",
+                "Region",
+                "Global",
+                "DistributionId",
+                dist_id,
+            ),
+        ),
+        VIEW_TIME_SERIES,
+        r,
+        "CloudFront 5xx: " + dist_id,
+    )
 
 
-def create_route53_widget(arn, r, y, dimension_config):
-    healthcheck_id = arn.split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/Route53",
-                    "HealthCheckStatus",
-                    "HealthCheckId",
-                    healthcheck_id,
-                    {"stat": "Minimum"},
-                ]
-            ],
-            "view": "timeSeries",
-            "region": r,
-            "title": f"Route53 Health Check: {healthcheck_id}",
-        },
-    }
+def create_route53_widget(arn, r, y):
+    healthcheck_id = arn.rpartition("/")[2]
+    return Widget(
+        y,
+        (
+            (
+                "AWS/Route53",
+                "HealthCheckStatus",
+                "HealthCheckId",
+                healthcheck_id,
+                STAT_MIN,
+            ),
+        ),
+        VIEW_TIME_SERIES,
+        r,
+        "Route53 Health Check: " + healthcheck_id,
+    )
 
 
-def create_acm_widget(arn, r, y, dimension_config):
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/CertificateManager",
-                    "DaysToExpiry",
-                    "CertificateArn",
-                    arn,
-                    {"stat": "Minimum"},
-                ]
-            ],
-            "view": "singleValue",
-            "region": r,
-            "title": f"ACM Cert Expiry: ...{arn[-12:]}",
-        },
-    }
+def create_acm_widget(arn, r, y):
+    return Widget(
+        y,
+        (
+            (
+                "AWS/CertificateManager",
+                "DaysToExpiry",
+                "CertificateArn",
+                arn,
+                STAT_MIN,
+            ),
+        ),
+        VIEW_SINGLE_VALUE,
+        r,
+        "ACM Cert Expiry: ..." + arn[-12:],
+    )
 
 
-def create_elasticache_widget(arn, region, y, dimension_config):
-    c = arn.split(":")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/ElastiCache", "CPUUtilization", "CacheClusterId", c],
-                ["...", "FreeableMemory"],
-                ["...", "NetworkBytesIn"],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"ElastiCache: {c}",
-        },
-    }
+def create_elasticache_widget(arn, region, y):
+    c = arn.rpartition(":")[2]
+    return Widget(
+        y,
+        (
+            ("AWS/ElastiCache", "CPUUtilization", "CacheClusterId", c),
+            ("...", "FreeableMemory"),
+            ("...", "NetworkBytesIn"),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "ElastiCache: " + c,
+    )
 
 
-def create_fsx_widget(arn, region, y, dimension_config):
-    fs = arn.split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/FSx",
-                    "FreeStorageCapacity",
-                    "FileSystemId",
-                    fs,
-                    {"stat": "Minimum"},
-                ]
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"FSx Free Storage: {fs}",
-        },
-    }
+def create_fsx_widget(arn, region, y):
+    fs = arn.rpartition("/")[2]
+    return Widget(
+        y,
+        (
+            (
+                "AWS/FSx",
+                "FreeStorageCapacity",
+                "FileSystemId",
+                fs,
+                STAT_MIN,
+            ),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "FSx Free Storage: " + fs,
+    )
 
 
-def create_storagegateway_widget(arn, region, y, dimension_config):
-    gw_id = arn.split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/StorageGateway",
-                    "CachePercentDirty",
-                    "GatewayId",
-                    gw_id,
-                    {"stat": "Maximum"},
-                ]
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"Storage Gateway: {gw_id}",
-        },
-    }
+def create_storagegateway_widget(arn, region, y):
+    gw_id = arn.rpartition("/")[2]
+    return Widget(
+        y,
+        (
+            (
+                "AWS/StorageGateway",
+                "CachePercentDirty",
+                "GatewayId",
+                gw_id,
+                STAT_MAX,
+            ),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "Storage Gateway: " + gw_id,
+    )
 
 
-def create_dx_widget(arn, region, y, dimension_config):
-    c = arn.split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/DX", "ConnectionState", "ConnectionId", c, {"stat": "Minimum"}]
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"Direct Connect: {c}",
-        },
-    }
+def create_dx_widget(arn, region, y):
+    c = arn.rpartition("/")[2]
+    return Widget(
+        y,
+        (("AWS/DX", "ConnectionState", "ConnectionId", c, STAT_MIN),),
+        VIEW_TIME_SERIES,
+        region,
+        "Direct Connect: " + c,
+    )
 
 
-def create_vpn_widget(arn, region, y, dimension_config):
-    vpn_id = arn.split("/")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    {
-                        "expression": f"SEARCH('{{AWS/VPN,VpnId}} MetricName=\"TunnelState\" VpnId=\"{vpn_id}\"', 'Minimum', 300)"
-                    }
-                ]
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"VPN Tunnels: {vpn_id}",
-        },
-    }
+def create_vpn_widget(arn, region, y):
+    vpn_id = arn.rpartition("/")[2]
+    return Widget(
+        y,
+        (
+            (
+                {
+                    "expression": f"SEARCH('{{AWS/VPN,VpnId}} MetricName=\"TunnelState\" VpnId=\"{vpn_id}\"', 'Minimum', 300)"
+                },
+            ),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "VPN Tunnels: " + vpn_id,
+    )
 
 
-def create_apigateway_widget(arn, region, y, dimension_config):
-    parts = arn.split(":")
-    api_info = parts[5].split("/")
-    api_id = api_info[2]
-    stage_name = api_info[4]
-    api_gateway_dims = dimension_config.get(
-        "AWS/ApiGateway", [{"Name": "ApiName", "Value": f"{api_id}/{stage_name}"}]
-    )
-    metrics = []
-    for dim_set in api_gateway_dims:
-        metrics.extend(
-            [
-                [
+def parse_apigw_stage_arn(arn):
+    # arn:aws:apigateway:REGION::/restapis/API_ID/stages/STAGE for REST APIs,
+    # arn:aws:apigateway:REGION::/apis/API_ID/stages/STAGE for HTTP/WebSocket.
+    path = arn.find(":/") + 2
+    if arn.startswith("restapis/", path):
+        start = path + 9
+    elif arn.startswith("apis/", path):
+        start = path + 5
+    else:
+        raise ValueError(f"Not an API Gateway stage ARN: {arn}")
+    end = arn.find("/", start)
+    if end <= start or not arn.startswith("/stages/", end):
+        raise ValueError(f"Not an API Gateway stage ARN: {arn}")
+    stage_name = arn[end + 8 :]
+    if not stage_name or "/" in stage_name:
+        raise ValueError(f"Not an API Gateway stage ARN: {arn}")
+    return arn[start:end], stage_name
+
+
+def create_apigateway_widget(arn, region, y, dimension_config=DIMENSION_CONFIG):
+    api_id, stage_name = parse_apigw_stage_arn(arn)
+    api_gateway_dims = dimension_config.get("AWS/ApiGateway")
+    if api_gateway_dims is None:
+        api_gateway_dims = [Dim("ApiName", f"{api_id}/{stage_name}")]
+    metrics = tuple(
+        chain.from_iterable(
+            (
+                (
                     "AWS/ApiGateway",
                     "5XXError",
-                    dim_set["Name"],
-                    dim_set["Value"],
-                    {"stat": "Sum"},
-                ],
-                ["...", "4XXError", {"stat": "Sum"}],
-                ["...", "Latency", {"stat": "Average"}],
-                ["...", "Count", {"stat": "Sum"}],
-            ]
+                    dim_set.name,
+                    dim_set.value,
+                    STAT_SUM,
+                ),
+                APIGW_4XX_ROW,
+                APIGW_LATENCY_ROW,
+                APIGW_COUNT_ROW,
+            )
+            for dim_set in api_gateway_dims
         )
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": metrics,
-            "view": "timeSeries",
-            "region": region,
-            "title": "API Gateway Performance",
-        },
-    }
+    )
+    return Widget(
+        y,
+        metrics,
+        VIEW_TIME_SERIES,
+        region,
+        "API Gateway Performance",
+    )
 
 
-def create_stepfunctions_widget(arn, region, y, dimension_config):
-    sm_name = arn.split(":")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                [
-                    "AWS/States",
-                    "ExecutionsFailed",
-                    "StateMachineArn",
-                    arn,
-                    {"stat": "Sum"},
-                ],
-                ["...", "ExecutionTime", {"stat": "Average"}],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"Step Functions: {sm_name}",
-        },
-    }
+def create_stepfunctions_widget(arn, region, y):
+    sm_name = arn.rpartition(":")[2]
+    return Widget(
+        y,
+        (
+            (
+                "AWS/States",
+                "ExecutionsFailed",
+                "StateMachineArn",
+                arn,
+                STAT_SUM,
+            ),
+            ("...", "ExecutionTime", STAT_AVG),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "Step Functions: " + sm_name,
+    )
 
 
-def create_mq_widget(arn, region, y, dimension_config):
-    broker_name = arn.split(":")[-1]
-    return {
-        "type": "metric",
-        "x": 0,
-        "y": y,
-        "width": 24,
-        "height": 7,
-        "properties": {
-            "metrics": [
-                ["AWS/AmazonMQ", "CpuUtilization", "Broker", broker_name],
-                ["...", "TotalMessageCount"],
-            ],
-            "view": "timeSeries",
-            "region": region,
-            "title": f"Amazon MQ: {broker_name}",
-        },
-    }
+def create_mq_widget(arn, region, y):
+    broker_name = arn.rpartition(":")[2]
+    return Widget(
+        y,
+        (
+            ("AWS/AmazonMQ", "CpuUtilization", "Broker", broker_name),
+            ("...", "TotalMessageCount"),
+        ),
+        VIEW_TIME_SERIES,
+        region,
+        "Amazon MQ: " + broker_name,
+    )
+
+
+# Per-resource widget builders, keyed like ALL_SERVICES_CONFIG. All share the
+# (arn, region, y) signature; the API Gateway builder also takes an optional
+# dimension_config, defaulting to DIMENSION_CONFIG.
+WIDGET_BUILDERS = {
+    "ec2_instance": create_ec2_hybrid_widget,
+    "rds_instance": create_rds_detailed_widget,
+    "lambda_function": create_lambda_widget,
+    "alb": create_alb_widget,
+    "nlb": create_nlb_widget,
+    "classic_elb": create_classic_elb_widget,
+    "ecs_service": create_ecs_widget,
+    "eks_cluster": create_eks_widget,
+    "dynamodb_table": create_dynamodb_widget,
+    "redshift_cluster": create_redshift_widget,
+    "sqs_queue": create_sqs_widget,
+    "sns_topic": create_sns_widget,
+    "cloudfront_distribution": create_cloudfront_widget,
+    "route53_healthcheck": create_route53_widget,
+    "acm_certificate": create_acm_widget,
+    "elasticache_cluster": create_elasticache_widget,
+    "fsx_filesystem": create_fsx_widget,
+    "storage_gateway": create_storagegateway_widget,
+    "dx_connection": create_dx_widget,
+    "vpn_connection": create_vpn_widget,
+    "apigateway_stage": create_apigateway_widget,
+    "stepfunctions_statemachine": create_stepfunctions_widget,
+    "mq_broker": create_mq_widget,
+}
+
+# Attach each service's builder once at import, so a service missing from
+# WIDGET_BUILDERS fails at cold start instead of per resource. Global services
+# always report to us-east-1; the rest use the invocation region (None).
+for service_key, service_config in ALL_SERVICES_CONFIG.items():
+    service_config["builder"] = WIDGET_BUILDERS[service_key]
+    service_config["fixed_region"] = (
+        "us-east-1" if service_config.get("is_global", False) else None
+    )
+
+# Aggregate SLO rows in dashboard order, as (slo_resources bucket, builder,
+# (namespace, metric, dimension) that must exist before building or None,
+# extra builder args).
+SLO_JOBS = [
+    ("alb", create_aggregate_alb_slo_widget, None, (SLO_TARGET,)),
+    ("lambda", create_aggregate_lambda_slo_widget, None, (SLO_TARGET,)),
+    ("cloudfront", create_aggregate_cloudfront_slo_widget, None, (SLO_TARGET,)),
+    (
+        "ec2",
+        create_aggregate_ec2_slo_widget,
+        ("AWS/EC2", "CPUUtilization", "InstanceId"),
+        (CPU_SLO_TARGET,),
+    ),
+    (
+        "rds",
+        create_aggregate_rds_slo_widget,
+        ("AWS/RDS", "ReadLatency", "DBInstanceIdentifier"),
+        (LATENCY_SLO_TARGET_S, RDS_CPU_SLO_TARGET, LATENCY_SLO_TARGET_MS),
+    ),
+]
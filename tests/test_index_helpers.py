@@ -0,0 +1,312 @@
+import importlib.util
+import json
+import os
+from datetime import datetime, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+INDEX_PATH = os.path.join(os.path.dirname(__file__), "..", "lambda", "index.py")
+
+
+# --- Test Setup Helper ---
+def load_index(monkeypatch, tmp_path, enabled_widgets="apigateway_stage"):
+    """
+    Loads a fresh copy of lambda/index.py. Configuration is read at import, so
+    each test sets its environment first and gets its own module instance.
+    """
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("ENABLED_WIDGETS", enabled_widgets)
+    spec = importlib.util.spec_from_file_location("index", INDEX_PATH)
+    index = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(index)
+    # Keep the CWAgent cache out of the shared /tmp of the test host.
+    index.METRICS_CACHE_FILE = str(tmp_path / "cwagent_cache.json")
+    index.metrics_cache.clear()
+    return index
+
+
+# --- API Gateway stage ARN parsing ---
+@pytest.mark.parametrize(
+    "arn, expected",
+    [
+        (
+            "arn:aws:apigateway:us-east-1::/restapis/abc123/stages/prod",
+            ("abc123", "prod"),
+        ),
+        (
+            "arn:aws:apigateway:us-east-1::/apis/h1t2p3/stages/$default",
+            ("h1t2p3", "$default"),
+        ),
+    ],
+)
+def test_parse_apigw_stage_arn_accepts_rest_and_http_apis(
+    monkeypatch, tmp_path, arn, expected
+):
+    """Both REST (/restapis/) and HTTP/WebSocket (/apis/) stage ARNs parse."""
+    index = load_index(monkeypatch, tmp_path)
+    assert index.parse_apigw_stage_arn(arn) == expected
+
+
+@pytest.mark.parametrize(
+    "arn",
+    [
+        "arn:aws:apigateway:us-east-1::/restapis/abc123",
+        "arn:aws:apigateway:us-east-1::/restapis//stages/prod",
+        "arn:aws:apigateway:us-east-1::/restapis/abc123/stages/",
+        "arn:aws:apigateway:us-east-1::/restapis/abc123/stages/prod/extra",
+        "arn:aws:apigateway:us-east-1::/apis/h1t2p3/routes/r1",
+        "arn:aws:apigateway:us-east-1::/domainnames/example.com",
+    ],
+)
+def test_parse_apigw_stage_arn_rejects_malformed(monkeypatch, tmp_path, arn):
+    index = load_index(monkeypatch, tmp_path)
+    with pytest.raises(ValueError):
+        index.parse_apigw_stage_arn(arn)
+
+
+@pytest.mark.parametrize("api_path", ["restapis", "apis"])
+def test_apigateway_stage_widget_for_both_arn_forms(monkeypatch, tmp_path, api_path):
+    """Both ARN forms are routed to the API Gateway builder and get a widget."""
+    index = load_index(monkeypatch, tmp_path)
+    arn = f"arn:aws:apigateway:us-east-1::/{api_path}/abc123/stages/prod"
+
+    config = index.match_service_config(arn)
+    assert config is not None
+    widget = index.build_resource_widget(arn, config, "us-east-1")
+
+    assert widget is not None
+    metrics = widget.to_dict()["properties"]["metrics"]
+    assert metrics[0][:4] == ("AWS/ApiGateway", "5XXError", "ApiName", "abc123/prod")
+
+
+# --- Dashboard publishing ---
+@mock_aws
+def test_publish_dashboard_reports_updated_unchanged_and_failed(monkeypatch, tmp_path):
+    """The handler body reflects whether PutDashboard actually wrote."""
+    index = load_index(monkeypatch, tmp_path)
+    widgets = [index.RESOURCE_HEADER_WIDGET | {"y": 0}]
+
+    first = index.publish_dashboard("Helpers-Test", widgets, "updated")
+    second = index.publish_dashboard("Helpers-Test", widgets, "updated")
+
+    assert first == {"statusCode": 200, "body": "updated"}
+    assert second["statusCode"] == 200
+    assert "unchanged" in second["body"]
+
+    def fail(**kwargs):
+        raise ClientError({"Error": {"Code": "InvalidParameterInput"}}, "PutDashboard")
+
+    monkeypatch.setattr(index.cloudwatch_client, "put_dashboard", fail)
+    failed = index.publish_dashboard("Other-Dashboard", widgets, "updated")
+
+    assert failed["statusCode"] == 500
+
+
+# --- Service matching ---
+LB_ARN = "arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer"
+
+
+@pytest.mark.parametrize("lb_type", ["app", "net", "gwy"])
+def test_classic_elb_config_ignores_v2_load_balancers(monkeypatch, tmp_path, lb_type):
+    """ALB/NLB/GWLB ARNs contain "loadbalancer" but are never classic ELBs."""
+    index = load_index(monkeypatch, tmp_path, enabled_widgets="classic_elb")
+    assert (
+        index.match_service_config(f"{LB_ARN}/{lb_type}/my-lb/50dc6c495c0c9188") is None
+    )
+
+
+def test_load_balancer_arns_route_to_their_own_config(monkeypatch, tmp_path):
+    index = load_index(monkeypatch, tmp_path, enabled_widgets="alb,nlb,classic_elb")
+
+    classic = index.match_service_config(f"{LB_ARN}/my-classic-lb")
+    alb = index.match_service_config(f"{LB_ARN}/app/my-alb/50dc6c495c0c9188")
+    nlb = index.match_service_config(f"{LB_ARN}/net/my-nlb/50dc6c495c0c9188")
+
+    assert classic["builder"] is index.create_classic_elb_widget
+    assert alb["builder"] is index.create_alb_widget
+    assert nlb["builder"] is index.create_nlb_widget
+
+
+# --- SLO widgets ---
+def test_alb_slo_widget_searches_each_load_balancer(monkeypatch, tmp_path):
+    """Both SEARCH expressions OR the LoadBalancer names and feed one SLO."""
+    index = load_index(monkeypatch, tmp_path)
+    resources = [
+        {"ResourceARN": f"{LB_ARN}/app/alb-one/1111"},
+        {"ResourceARN": f"{LB_ARN}/app/alb-two/2222"},
+    ]
+
+    graph, value = index.create_aggregate_alb_slo_widget(
+        resources, "us-east-1", 3, 99.9
+    )
+    requests, errors, slo = graph["properties"]["metrics"]
+
+    names = '("app/alb-one/1111" OR "app/alb-two/2222")'
+    assert 'MetricName="RequestCount"' + names in requests["expression"]
+    assert 'MetricName="HTTPCode_Target_5XX_Count"' + names in errors["expression"]
+    assert slo["expression"] == "100*(1-SUM(errors)/(SUM(requests)+0.000001))"
+    assert graph["y"] == value["y"] == 3
+
+
+@mock_aws
+def test_metrics_exist_for_resources_checks_recent_data(monkeypatch, tmp_path):
+    """Only resources with a datapoint in the lookback window count."""
+    index = load_index(monkeypatch, tmp_path)
+    index.cloudwatch_client.put_metric_data(
+        Namespace="AWS/Lambda",
+        MetricData=[
+            {
+                "MetricName": "Invocations",
+                "Dimensions": [{"Name": "FunctionName", "Value": "busy"}],
+                "Timestamp": datetime.now(timezone.utc),
+                "Value": 1,
+            }
+        ],
+    )
+
+    def exists(function_name):
+        return index.metrics_exist_for_resources(
+            "AWS/Lambda", "Invocations", "FunctionName", [{"ResourceId": function_name}]
+        )
+
+    assert exists("busy") is True
+    assert exists("idle") is False
+
+
+@mock_aws
+def test_metrics_exist_for_resources_returns_false_on_client_error(
+    monkeypatch, tmp_path
+):
+    index = load_index(monkeypatch, tmp_path)
+
+    def fail(**kwargs):
+        raise ClientError({"Error": {"Code": "Throttling"}}, "GetMetricData")
+
+    monkeypatch.setattr(index.cloudwatch_client, "get_metric_data", fail)
+    assert (
+        index.metrics_exist_for_resources(
+            "AWS/Lambda", "Invocations", "FunctionName", [{"ResourceId": "busy"}]
+        )
+        is False
+    )
+
+
+# --- Tagged resource discovery ---
+def test_get_tagged_resources_reraises_client_error(monkeypatch, tmp_path):
+    """A failed tag lookup must not look like an empty dashboard."""
+    index = load_index(monkeypatch, tmp_path)
+
+    def fail(tag_filters, resource_type_filters):
+        raise ClientError({"Error": {"Code": "AccessDenied"}}, "GetResources")
+
+    monkeypatch.setattr(index, "get_resources_for_filters", fail)
+    with pytest.raises(ClientError):
+        index.get_tagged_resources("Dashboard", "main", ["lambda:function"])
+
+
+# --- Widget serialization ---
+def test_custom_widget_does_not_mutate_definition(monkeypatch, tmp_path):
+    index = load_index(monkeypatch, tmp_path)
+    widget_def = {"type": "text", "height": 3, "properties": {"markdown": "hi"}}
+
+    widget, height = index.create_custom_widget(widget_def, "eu-west-1", 12)
+
+    assert height == 3
+    assert widget["y"] == 12
+    assert widget["properties"]["region"] == "eu-west-1"
+    assert widget_def == {"type": "text", "height": 3, "properties": {"markdown": "hi"}}
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_dashboard_body_serializes_widgets_and_stats(
+    monkeypatch, tmp_path, use_orjson
+):
+    """Widget dataclasses and MappingProxyType stats render as plain JSON."""
+    index = load_index(monkeypatch, tmp_path)
+    if not use_orjson:
+        monkeypatch.setattr(index, "orjson", None)
+    elif index.orjson is None:
+        pytest.skip("orjson is not installed")
+    widget = index.Widget(
+        0,
+        (("AWS/SQS", "NumberOfMessagesSent", "QueueName", "q", index.STAT_SUM),),
+        index.VIEW_TIME_SERIES,
+        "us-east-1",
+        "SQS",
+    )
+
+    body = json.loads(index.dumps_dashboard_body({"widgets": [widget]}))
+
+    assert body["widgets"][0]["type"] == "metric"
+    assert body["widgets"][0]["properties"]["title"] == "SQS"
+    assert body["widgets"][0]["properties"]["metrics"][0][-1] == {"stat": "Sum"}
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_dashboard_body_rejects_unknown_types(monkeypatch, tmp_path, use_orjson):
+    index = load_index(monkeypatch, tmp_path)
+    if not use_orjson:
+        monkeypatch.setattr(index, "orjson", None)
+    elif index.orjson is None:
+        pytest.skip("orjson is not installed")
+    with pytest.raises(TypeError):
+        index.dumps_dashboard_body({"widgets": [object()]})
+
+
+# --- CWAgent discovery ---
+def test_prefetch_agent_metrics_scans_namespace_only_above_threshold(
+    monkeypatch, tmp_path
+):
+    """A few stale instances are fetched one by one; many use a single scan."""
+    index = load_index(monkeypatch, tmp_path)
+    monkeypatch.setattr(index, "AGENT_INDEX_SCAN_THRESHOLD", 2)
+    per_instance, scans = [], []
+
+    def fetch_one(instance_id):
+        per_instance.append(instance_id)
+        return [["CWAgent", "mem_used_percent", "InstanceId", instance_id]]
+
+    def fetch_index():
+        scans.append(True)
+        return {"i-3": [["CWAgent", "disk_used_percent", "InstanceId", "i-3"]]}
+
+    monkeypatch.setattr(index, "fetch_agent_metrics", fetch_one)
+    monkeypatch.setattr(index, "fetch_agent_metrics_index", fetch_index)
+
+    index.prefetch_agent_metrics(["i-1", "i-2"])
+    assert sorted(per_instance) == ["i-1", "i-2"] and not scans
+    assert index.cache_get("CWAgent:i-1")[0][1] == "mem_used_percent"
+
+    index.prefetch_agent_metrics(["i-1", "i-3", "i-4", "i-5"])
+    assert len(scans) == 1 and len(per_instance) == 2
+    assert index.cache_get("CWAgent:i-3")[0][1] == "disk_used_percent"
+    assert index.cache_get("CWAgent:i-4") == []
+
+
+# --- Logging ---
+def test_invalid_log_level_falls_back_to_warning(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOG_LEVEL", "verbose")
+    index = load_index(monkeypatch, tmp_path)
+    assert index.logger.level == index.logging.WARNING
+
+
+def test_ec2_agent_widget_failure_is_logged_as_warning(monkeypatch, tmp_path, caplog):
+    """A failed agent lookup falls back to the standard widget, visibly."""
+    index = load_index(monkeypatch, tmp_path)
+
+    def fail(instance_id, region, y):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(index, "create_dynamic_agent_widget", fail)
+    arn = "arn:aws:ec2:us-east-1:123456789012:instance/i-0abc"
+    widget = index.create_ec2_hybrid_widget(arn, "us-east-1", 0)
+
+    assert widget is not None
+    assert any(
+        r.levelname == "WARNING" and "i-0abc" in r.getMessage() for r in caplog.records
+    )